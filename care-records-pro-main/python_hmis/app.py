@@ -1,17 +1,247 @@
 from __future__ import annotations
+import codecs
 import csv
-import io
+import hashlib
+import itertools
+import operator
 import os
+import queue
 import sqlite3
-from datetime import datetime, date
-from typing import Any, Dict, List, Optional, Tuple
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, date, timedelta
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
 
-from flask import Flask, redirect, render_template, request, Response, url_for, jsonify
+import orjson
+from flask import Flask, g, redirect, render_template, request, Response, stream_with_context, url_for, jsonify
+from flask.json.provider import DefaultJSONProvider
 
 APP_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_PATH = os.path.join(APP_DIR, "hmis.db")
+# HMIS_DB_PATH points the app at another database file (the tests use a temp one)
+DB_PATH = os.environ.get("HMIS_DB_PATH") or os.path.join(APP_DIR, "hmis.db")
+# Bump whenever init_db() gains new DDL so existing databases pick it up
+SCHEMA_VERSION = 8
+# Read-only connections opened at startup and kept between requests
+POOL_SIZE = 8
+# Patients shown per page on the index view
+PATIENTS_PAGE_SIZE = 50
+# Default and maximum ?limit= for the paged /api list endpoints
+LIST_PAGE_SIZE = 50
+LIST_PAGE_MAX = 200
+# Rows per executemany call when loading CSV uploads
+IMPORT_BATCH_SIZE = 10_000
+# Seconds a cached GET /api/* body stays fresh, and how many are kept
+API_CACHE_TTL = 5.0
+API_CACHE_MAX = 1024
+# Dashboard counts need not be second-accurate
+METRICS_CACHE_TTL = 60.0
+# Bytes of encoded CSV gathered before each streamed chunk is sent
+CSV_CHUNK_SIZE = 64 * 1024
+
+LAB_TEST_SEED: List[Tuple[str, str, str, Optional[str], Optional[str]]] = [
+    ("CBC", "Complete Blood Count", "Blood", None, None),
+    ("GLU", "Blood Glucose (Fasting)", "Blood", "mg/dL", "70-100"),
+    ("LFT", "Liver Function Test", "Blood", None, None),
+]
+
+# --- SQL ---
+# Hot statements live in module constants so every call site hands the
+# driver the exact same string and hits its per-connection statement cache.
+
+# UTC timestamp computed by SQLite; same shape as datetime.utcnow().isoformat()
+SQL_NOW = "strftime('%Y-%m-%dT%H:%M:%f', 'now')"
+
+SQL_LIST_PATIENTS = "SELECT * FROM patients ORDER BY full_name"
+# Keyset pagination over idx_patients_name_nocase; (full_name, usn) is the cursor
+SQL_PATIENTS_PAGE = "SELECT * FROM patients ORDER BY full_name COLLATE NOCASE, usn LIMIT ?"
+SQL_PATIENTS_PAGE_AFTER = (
+    "SELECT * FROM patients WHERE (full_name, usn) > (? COLLATE NOCASE, ?) "
+    "ORDER BY full_name COLLATE NOCASE, usn LIMIT ?"
+)
+SQL_FIND_PATIENT = "SELECT * FROM patients WHERE usn = ? OR contact = ?"
+SQL_GET_PATIENT = "SELECT * FROM patients WHERE usn = ?"
+SQL_PATIENT_EXISTS = "SELECT 1 FROM patients WHERE usn = ?"
+SQL_INSERT_PATIENT = (
+    "INSERT INTO patients(usn, full_name, age, gender, contact, address) VALUES(?,?,?,?,?,?)"
+)
+
+# CSV exports select columns in header order for execute_raw()/stream_csv()
+SQL_EXPORT_PATIENTS = "SELECT usn, full_name, age, gender, contact, address FROM patients ORDER BY full_name"
+SQL_EXPORT_VITALS = """
+    SELECT v.usn, p.full_name, v.weight, v.height,
+           v.bmi, v.blood_pressure_systolic, v.blood_pressure_diastolic,
+           v.heart_rate, v.temperature, v.respiratory_rate,
+           v.oxygen_saturation, v.notes, v.recorded_at
+    FROM vitals v
+    JOIN patients p ON v.usn = p.usn
+    ORDER BY v.recorded_at DESC
+"""
+SQL_EXPORT_RX = """
+    SELECT p.usn, pa.full_name, p.notes, p.prescribed_at
+    FROM prescriptions p
+    JOIN patients pa ON p.usn = pa.usn
+    ORDER BY p.prescribed_at DESC
+"""
+SQL_EXPORT_COMPLETE = """
+    WITH vc AS (SELECT usn, COUNT(*) AS c FROM vitals GROUP BY usn),
+    pc AS (SELECT usn, COUNT(*) AS c FROM prescriptions GROUP BY usn)
+    SELECT
+        p.usn, p.full_name, p.age, p.gender, p.contact, p.address,
+        l.weight as latest_weight,
+        l.height as latest_height,
+        l.bmi as latest_bmi,
+        l.blood_pressure_systolic || '/' || l.blood_pressure_diastolic as latest_bp,
+        l.heart_rate as latest_hr,
+        l.temperature as latest_temp,
+        COALESCE(vc.c, 0) as total_vitals,
+        COALESCE(pc.c, 0) as total_prescriptions
+    FROM patients p
+    LEFT JOIN latest_vitals l ON l.usn = p.usn
+    LEFT JOIN vc ON vc.usn = p.usn
+    LEFT JOIN pc ON pc.usn = p.usn
+    ORDER BY p.full_name
+"""
+# One row per patient x prescription, with the latest vitals (/export.csv)
+SQL_EXPORT_ALL = """
+    SELECT
+        p.usn, p.full_name, p.age, p.gender, p.contact, p.address,
+        v.blood_pressure_systolic || '/' || v.blood_pressure_diastolic,
+        v.heart_rate, v.temperature, v.weight, v.height, v.recorded_at,
+        replace(r.notes, char(10), ' '), r.prescribed_at
+    FROM patients p
+    LEFT JOIN latest_vitals v ON v.usn = p.usn
+    LEFT JOIN prescriptions r ON r.usn = p.usn
+    ORDER BY p.usn, r.id
+"""
+
+SQL_LIST_VITALS = "SELECT * FROM vitals ORDER BY recorded_at DESC"
+SQL_VITALS_BY_USN = "SELECT * FROM vitals WHERE usn = ? ORDER BY recorded_at DESC"
+SQL_INSERT_VITALS = f"""INSERT INTO vitals(usn, weight, height, blood_pressure_systolic, blood_pressure_diastolic,
+   heart_rate, temperature, respiratory_rate, oxygen_saturation, notes, recorded_at)
+   VALUES(?,?,?,?,?,?,?,?,?,?,{SQL_NOW})"""
+
+# Aggregated in one pass by SQLite rather than in a Python loop over rows
+VITALS_STAT_COLUMNS = (
+    "weight", "bmi", "blood_pressure_systolic", "blood_pressure_diastolic",
+    "heart_rate", "temperature", "respiratory_rate", "oxygen_saturation",
+)
+_VITALS_STAT_SELECT = ", ".join(
+    f"AVG({c}), MIN({c}), MAX({c})" for c in VITALS_STAT_COLUMNS
+)
+SQL_VITALS_STATS = f"SELECT COUNT(*), MAX(recorded_at), {_VITALS_STAT_SELECT} FROM vitals"
+SQL_VITALS_STATS_BY_USN = f"{SQL_VITALS_STATS} WHERE usn = ?"
+
+SQL_LIST_RX = "SELECT * FROM prescriptions ORDER BY prescribed_at DESC"
+SQL_RX_BY_USN = "SELECT * FROM prescriptions WHERE usn = ? ORDER BY prescribed_at DESC"
+SQL_INSERT_RX = f"INSERT INTO prescriptions(usn, notes, prescribed_at) VALUES(?,?,{SQL_NOW})"
+
+# Keyset pages, newest first, bound with page_args() names; a missing
+# before_id (-1) bounds on the timestamp alone
+_APPTS_PAGE = """
+    SELECT * FROM appointments
+    WHERE {filter}(starts_at, id) < (COALESCE(:before, '9999'), COALESCE(:before_id, -1))
+    ORDER BY starts_at DESC, id DESC
+    LIMIT :limit
+"""
+SQL_APPTS_PAGE = _APPTS_PAGE.format(filter="")
+SQL_APPTS_PAGE_BY_USN = _APPTS_PAGE.format(filter="usn = :usn AND ")
+# Returns the new id, or no row when the patient does not exist
+SQL_INSERT_APPT = """
+    INSERT INTO appointments(usn, starts_at, ends_at, status, title, clinician, notes)
+    SELECT ?1, ?2, ?3, 'Scheduled', ?4, ?5, ?6
+    WHERE EXISTS (SELECT 1 FROM patients WHERE usn = ?1)
+    RETURNING id
+"""
+SQL_UPDATE_APPT = """
+    UPDATE appointments
+    SET status = COALESCE(?, status),
+        title = COALESCE(?, title),
+        clinician = COALESCE(?, clinician),
+        notes = COALESCE(?, notes),
+        starts_at = COALESCE(?, starts_at),
+        ends_at = COALESCE(?, ends_at)
+    WHERE id = ?
+"""
+SQL_DELETE_APPT = "DELETE FROM appointments WHERE id = ?"
+
+SQL_LIST_LAB_TESTS = "SELECT * FROM lab_tests WHERE is_active = 1 ORDER BY name"
+# Returns the new id, or no row when the patient does not exist
+SQL_INSERT_LAB_ORDER = f"""
+    INSERT INTO lab_orders(usn, ordered_at, status, notes)
+    SELECT ?1, {SQL_NOW}, 'Ordered', ?2
+    WHERE EXISTS (SELECT 1 FROM patients WHERE usn = ?1)
+    RETURNING id
+"""
+SQL_INSERT_LAB_ITEM = "INSERT INTO lab_order_items(lab_order_id, lab_test_id) VALUES(?,?)"
+# Orders are paged before the item join so no order's items straddle two pages
+_LAB_ORDERS_PAGE = """
+    WITH page AS (
+        SELECT * FROM lab_orders
+        WHERE {filter}(ordered_at, id) < (COALESCE(:before, '9999'), COALESCE(:before_id, -1))
+        ORDER BY ordered_at DESC, id DESC
+        LIMIT :limit
+    )
+    SELECT lo.*, loi.id AS item_id, lt.code, lt.name, loi.status AS item_status, loi.result_value, loi.result_at
+    FROM page lo
+    JOIN lab_order_items loi ON loi.lab_order_id = lo.id
+    JOIN lab_tests lt ON lt.id = loi.lab_test_id
+    ORDER BY lo.ordered_at DESC, lo.id DESC
+"""
+SQL_LAB_ORDERS_PAGE = _LAB_ORDERS_PAGE.format(filter="")
+SQL_LAB_ORDERS_PAGE_BY_USN = _LAB_ORDERS_PAGE.format(filter="usn = :usn AND ")
+SQL_SET_LAB_RESULT = f"""
+    UPDATE lab_order_items
+    SET result_value = ?, result_notes = ?, result_at = {SQL_NOW}, status = 'Completed'
+    WHERE id = ?
+    RETURNING lab_order_id
+"""
+SQL_COMPLETE_LAB_ORDER = """
+    UPDATE lab_orders SET status = 'Completed'
+    WHERE id = ?1 AND NOT EXISTS (
+        SELECT 1 FROM lab_order_items WHERE lab_order_id = ?1 AND status <> 'Completed'
+    )
+"""
+
+# ?1/?2 are today's and tomorrow's dates, so both day counts are index range scans
+SQL_METRICS = """
+    SELECT
+        (SELECT COUNT(1) FROM patients),
+        (SELECT COUNT(1) FROM appointments WHERE starts_at >= ?1 AND starts_at < ?2),
+        (SELECT COUNT(1) FROM lab_order_items WHERE status <> 'Completed'),
+        (SELECT COUNT(1) FROM vitals WHERE recorded_at >= ?1 AND recorded_at < ?2)
+"""
+
+# Prepared on every new pooled connection. Only keyed lookups are listed:
+# preparing a full-table listing means running its scan. SQL_FIND_PATIENT
+# is left out because its "OR contact = ?" branch scans patients.
+_WARMUP_SQL: Tuple[str, ...] = (
+    SQL_GET_PATIENT,
+    SQL_PATIENT_EXISTS,
+    SQL_VITALS_BY_USN,
+    SQL_VITALS_STATS_BY_USN,
+    SQL_RX_BY_USN,
+)
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson, which encodes straight to UTF-8 bytes."""
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        return orjson.dumps(obj, default=self.default).decode()
+
+    def loads(self, s: str | bytes, **kwargs: Any) -> Any:
+        return orjson.loads(s)
+
+    def response(self, *args: Any, **kwargs: Any) -> Response:
+        # Skip the bytes -> str -> bytes round trip of the base implementation
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj, default=self.default), mimetype=self.mimetype)
+
 
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 
 # Enable very simple CORS for local development (Vite dev server default port is 8080)
 @app.after_request
@@ -35,15 +265,201 @@ def cors_preflight(any_path: str) -> Response:
 
 # --- Database helpers ---
 
-def get_db() -> sqlite3.Connection:
-    conn = sqlite3.connect(DB_PATH)
+def connect_db(readonly: bool = False) -> sqlite3.Connection:
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False, cached_statements=512)
     conn.row_factory = sqlite3.Row
     conn.execute("PRAGMA foreign_keys = ON;")
+    # NORMAL sync is durable in WAL mode, which ensure_db() switches on
+    conn.execute("PRAGMA synchronous = NORMAL;")
+    conn.execute("PRAGMA temp_store = MEMORY;")
+    conn.execute("PRAGMA mmap_size = 268435456;")
+    conn.execute("PRAGMA cache_size = -65536;")
+    if readonly:
+        conn.execute("PRAGMA query_only = ON;")
     return conn
 
 
+# Connections are reused across requests: one pool for the writer side and
+# one for read-only handlers, so we don't reopen the DB file on every hit.
+# LIFO hands out the most recently used connection, whose page cache is warmest.
+_RW_POOL: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue(maxsize=1)
+_RO_POOL: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue(maxsize=POOL_SIZE)
+
+
+def _warmup(conn: sqlite3.Connection) -> None:
+    """Compile the hot statements into the connection's statement cache."""
+    for sql in _WARMUP_SQL:
+        conn.execute(sql, (None,) * sql.count("?")).close()
+
+
+def fill_pools() -> None:
+    """Open and warm every pooled connection up front so no request pays for it."""
+    for pool, readonly in ((_RW_POOL, False), (_RO_POOL, True)):
+        while not pool.full():
+            conn = connect_db(readonly)
+            _warmup(conn)
+            pool.put_nowait(conn)
+
+
+def get_db(readonly: bool = False) -> sqlite3.Connection:
+    """Return this request's pooled connection, checking one out if needed."""
+    key = "_db_ro" if readonly else "_db"
+    conn = g.get(key)
+    if conn is None:
+        pool = _RO_POOL if readonly else _RW_POOL
+        try:
+            conn = pool.get_nowait()
+        except queue.Empty:
+            conn = connect_db(readonly)
+            _warmup(conn)
+        setattr(g, key, conn)
+    return conn
+
+
+@app.teardown_appcontext
+def release_db(exc: Optional[BaseException]) -> None:
+    for key, pool in (("_db", _RW_POOL), ("_db_ro", _RO_POOL)):
+        conn = g.pop(key, None)
+        if conn is None:
+            continue
+        # Never hand an open transaction to the next request
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+
+@contextmanager
+def write_txn(conn: sqlite3.Connection) -> Iterator[sqlite3.Connection]:
+    """Run a multi-statement write in one transaction, taking the write lock up front."""
+    conn.execute("BEGIN IMMEDIATE")
+    with conn:
+        yield conn
+
+
+def execute_raw(
+    conn: sqlite3.Connection, sql: str, params: Sequence[Any] | Dict[str, Any] = ()
+) -> sqlite3.Cursor:
+    """Execute on a cursor that yields plain tuples instead of sqlite3.Row objects.
+
+    Pooled connections use sqlite3.Row so handlers can index by name; hot
+    loops that know their SELECT order use this to skip building them.
+    """
+    cur = conn.cursor()
+    cur.row_factory = None
+    return cur.execute(sql, params)
+
+
+def query_dicts(
+    conn: sqlite3.Connection, sql: str, params: Sequence[Any] | Dict[str, Any] = ()
+) -> List[Dict[str, Any]]:
+    """Run a query and return JSON-ready dicts, reading column names only once."""
+    cur = execute_raw(conn, sql, params)
+    keys = [c[0] for c in cur.description]
+    return [dict(zip(keys, row)) for row in cur]
+
+
+class _Utf8Sink:
+    """csv.writer target that encodes each line to UTF-8 as it is written."""
+
+    __slots__ = ("buf",)
+
+    def __init__(self) -> None:
+        self.buf = bytearray()
+
+    def write(self, s: str) -> None:
+        self.buf += s.encode()
+
+    def flush(self) -> bytes:
+        out = bytes(self.buf)
+        self.buf.clear()
+        return out
+
+
+def stream_csv(header: Sequence[str], rows: Iterable[Sequence[Any]], filename: str) -> Response:
+    """Stream rows as a CSV attachment in CSV_CHUNK_SIZE pieces instead of building it in memory."""
+    def generate() -> Iterator[bytes]:
+        sink = _Utf8Sink()
+        writer = csv.writer(sink)
+        writer.writerow(header)
+        for row in rows:
+            writer.writerow(row)
+            if len(sink.buf) >= CSV_CHUNK_SIZE:
+                yield sink.flush()
+        yield sink.flush()
+
+    response = Response(stream_with_context(generate()), mimetype="text/csv")
+    response.headers["Content-Disposition"] = f"attachment; filename={filename}"
+    return response
+
+
+# Bumped after every write request; cache entries built at an older version
+# are misses. The per-process epoch keeps ETags from before a restart from
+# matching a counter that started over.
+_DATA_EPOCH = str(time.time_ns())
+_data_version = 0
+_data_version_lock = threading.Lock()
+
+# (endpoint, key) -> (data_version, expires_at or None, etag, encoded JSON body)
+_API_CACHE: Dict[Tuple[str, str], Tuple[int, Optional[float], str, bytes]] = {}
+
+
+def cached_json(key: Tuple[str, str], build: Callable[[], Any], ttl: Optional[float] = API_CACHE_TTL) -> Response:
+    """Serve build()'s JSON from _API_CACHE until the next write.
+
+    ttl also expires the entry after that many seconds, for payloads that
+    change with the clock; None keeps it until a write. The ETag names the
+    data version and a digest of the body, so a rebuild that comes out the
+    same still answers a matching If-None-Match with a 304.
+    """
+    now = time.monotonic()
+    # Read before building: a write that lands during build() bumps the
+    # version, so the entry is stale on arrival and never served again
+    version = _data_version
+    hit = _API_CACHE.get(key)
+    if hit is None or hit[0] != version or (hit[1] is not None and hit[1] <= now):
+        body = orjson.dumps(build())
+        if len(_API_CACHE) >= API_CACHE_MAX:
+            _API_CACHE.clear()
+        etag = f"{_DATA_EPOCH}-{version}-{hashlib.blake2b(body, digest_size=8).hexdigest()}"
+        hit = _API_CACHE[key] = (version, None if ttl is None else now + ttl, etag, body)
+    etag, body = hit[2:]
+    response = app.response_class(body, mimetype=app.json.mimetype)
+    response.set_etag(etag)
+    return response.make_conditional(request)
+
+
+@app.after_request
+def invalidate_api_cache(response: Response) -> Response:
+    # Any write may change what the cached GETs return. Failed requests are
+    # rolled back by write_txn / "with conn", so they leave the cache alone.
+    global _data_version
+    if request.method not in ("GET", "HEAD", "OPTIONS") and response.status_code < 400:
+        with _data_version_lock:
+            _data_version += 1
+    return response
+
+
+def page_args() -> Dict[str, Any]:
+    """Read keyset paging args (before, before_id, limit) from the query string.
+
+    Rows strictly older than (before, before_id) are returned newest first;
+    pass the last row's timestamp and id to get the next page. Raises
+    ValueError when before_id or limit is not an integer.
+    """
+    before_id = request.args.get("before_id")
+    limit = int(request.args.get("limit") or LIST_PAGE_SIZE)
+    return {
+        "before": (request.args.get("before") or "").strip() or None,
+        "before_id": int(before_id) if before_id else None,
+        "limit": max(1, min(limit, LIST_PAGE_MAX)),
+    }
+
+
 def init_db() -> None:
-    conn = get_db()
+    conn = connect_db()
     cur = conn.cursor()
     # Create tables if not existing (idempotent)
     cur.executescript(
@@ -70,7 +486,7 @@ def init_db() -> None:
             respiratory_rate INTEGER NULL,
             oxygen_saturation INTEGER NULL,
             notes TEXT NULL,
-            recorded_at TEXT NOT NULL,
+            recorded_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%f', 'now')),
             recorded_by TEXT NOT NULL DEFAULT 'System User',
             FOREIGN KEY (usn) REFERENCES patients(usn) ON DELETE CASCADE
         );
@@ -79,7 +495,7 @@ def init_db() -> None:
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             usn TEXT NOT NULL,
             notes TEXT NOT NULL,
-            prescribed_at TEXT NOT NULL,
+            prescribed_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%f', 'now')),
             FOREIGN KEY (usn) REFERENCES patients(usn) ON DELETE CASCADE
         );
 
@@ -103,7 +519,7 @@ def init_db() -> None:
             description TEXT NOT NULL,
             onset_date TEXT NULL,
             status TEXT NOT NULL DEFAULT 'Active',
-            recorded_at TEXT NOT NULL,
+            recorded_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%f', 'now')),
             FOREIGN KEY (usn) REFERENCES patients(usn) ON DELETE CASCADE
         );
 
@@ -114,7 +530,7 @@ def init_db() -> None:
             substance TEXT NOT NULL,
             reaction TEXT NULL,
             severity TEXT NULL,
-            recorded_at TEXT NOT NULL,
+            recorded_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%f', 'now')),
             FOREIGN KEY (usn) REFERENCES patients(usn) ON DELETE CASCADE
         );
 
@@ -158,7 +574,7 @@ def init_db() -> None:
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             usn TEXT NOT NULL,
             encounter_id INTEGER NULL,
-            ordered_at TEXT NOT NULL,
+            ordered_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%f', 'now')),
             status TEXT NOT NULL DEFAULT 'Ordered',
             notes TEXT NULL,
             FOREIGN KEY (usn) REFERENCES patients(usn) ON DELETE CASCADE,
@@ -206,7 +622,7 @@ def init_db() -> None:
             item_id INTEGER NOT NULL,
             quantity_on_hand INTEGER NOT NULL DEFAULT 0,
             reorder_level INTEGER NULL,
-            updated_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%f', 'now')),
             UNIQUE(item_id),
             FOREIGN KEY (item_id) REFERENCES inventory_items(id) ON DELETE CASCADE
         );
@@ -231,67 +647,200 @@ def init_db() -> None:
             action TEXT NOT NULL,
             details TEXT NULL
         );
+
+        -- Indexes for per-patient lookups and timestamp ordering
+        CREATE INDEX IF NOT EXISTS idx_vitals_usn_recorded ON vitals(usn, recorded_at DESC);
+        CREATE INDEX IF NOT EXISTS idx_rx_usn_prescribed ON prescriptions(usn, prescribed_at DESC);
+        CREATE INDEX IF NOT EXISTS idx_enc_usn_dt ON encounters(usn, encounter_dt DESC);
+        CREATE INDEX IF NOT EXISTS idx_problems_usn ON problems(usn);
+        CREATE INDEX IF NOT EXISTS idx_allergies_usn ON allergies(usn);
+        CREATE INDEX IF NOT EXISTS idx_labitems_order ON lab_order_items(lab_order_id);
+        CREATE INDEX IF NOT EXISTS idx_appts_starts ON appointments(starts_at);
+        CREATE INDEX IF NOT EXISTS idx_vitals_recorded ON vitals(recorded_at);
+        -- Ascending, so a backward scan yields (time DESC, id DESC) for keyset paging
+        CREATE INDEX IF NOT EXISTS idx_appts_usn_time ON appointments(usn, starts_at);
+        CREATE INDEX IF NOT EXISTS idx_laborders_usn_time ON lab_orders(usn, ordered_at);
+        CREATE INDEX IF NOT EXISTS idx_laborders_ordered ON lab_orders(ordered_at);
+        -- lab_tests.code is already UNIQUE; this serves the active catalogue listing
+        CREATE INDEX IF NOT EXISTS idx_labtests_active_name ON lab_tests(name) WHERE is_active = 1;
+        CREATE INDEX IF NOT EXISTS idx_patients_name_nocase ON patients(full_name COLLATE NOCASE, usn);
+        -- Plain by-name medications (no strength/form) are upserted by name.
+        -- The old SELECT-then-INSERT could store a name twice, so repoint items
+        -- at the lowest id per name and drop the extra rows before indexing.
+        UPDATE prescription_items SET medication_id = (
+            SELECT MIN(d.id) FROM medications m
+            JOIN medications d ON d.name = m.name AND d.strength IS NULL AND d.form IS NULL
+            WHERE m.id = prescription_items.medication_id
+        )
+        WHERE medication_id IN (SELECT id FROM medications WHERE strength IS NULL AND form IS NULL);
+        DELETE FROM medications
+        WHERE strength IS NULL AND form IS NULL AND id > (
+            SELECT MIN(d.id) FROM medications d
+            WHERE d.name = medications.name AND d.strength IS NULL AND d.form IS NULL
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_medications_name_plain ON medications(name)
+            WHERE strength IS NULL AND form IS NULL;
+        -- Newest vitals row per patient; the inner lookup is one seek on
+        -- idx_vitals_usn_recorded and the id match keeps timestamp ties to one row
+        CREATE VIEW IF NOT EXISTS latest_vitals AS
+            SELECT v.* FROM vitals v
+            WHERE v.id = (
+                SELECT v2.id FROM vitals v2 WHERE v2.usn = v.usn
+                ORDER BY v2.recorded_at DESC LIMIT 1
+            );
         """
     )
 
-    # Seed some lab tests if empty
-    if cur.execute("SELECT COUNT(1) FROM lab_tests").fetchone()[0] == 0:
-        cur.executemany(
-            "INSERT INTO lab_tests(code, name, specimen, unit, ref_range) VALUES(?,?,?,?,?)",
-            [
-                ("CBC", "Complete Blood Count", "Blood", "NULL", "NULL"),
-                ("GLU", "Blood Glucose (Fasting)", "Blood", "mg/dL", "70-100"),
-                ("LFT", "Liver Function Test", "Blood", "NULL", "NULL"),
-            ],
+    # Seed reference data in one transaction, one executemany per table
+    with conn:
+        if conn.execute("SELECT COUNT(1) FROM lab_tests").fetchone()[0] == 0:
+            conn.executemany(
+                "INSERT INTO lab_tests(code, name, specimen, unit, ref_range) VALUES(?,?,?,?,?)",
+                LAB_TEST_SEED,
+            )
+        # Older databases were seeded with the literal string 'NULL'
+        conn.execute(
+            "UPDATE lab_tests SET unit = NULLIF(unit, 'NULL'), ref_range = NULLIF(ref_range, 'NULL') "
+            "WHERE 'NULL' IN (unit, ref_range)"
         )
-
-    conn.commit()
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
     conn.close()
 
 
-@app.before_request
 def ensure_db() -> None:
-    # Auto-create DB and tables
-    if not os.path.exists(DB_PATH):
-        init_db()
-    else:
-        # Ensure new tables exist on older DBs
+    # Auto-create DB and tables once at startup; older DBs are migrated
+    # when their user_version lags SCHEMA_VERSION
+    conn = connect_db()
+    # WAL lets readers run alongside the writer. The journal mode is stored
+    # in the database file, so it is set once here, not per connection.
+    conn.execute("PRAGMA journal_mode = WAL;")
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    conn.close()
+    if version < SCHEMA_VERSION:
         init_db()
 
 
+ensure_db()
+fill_pools()
+
+
+# --- Form helpers ---
+
+class FormSpec:
+    """Field name -> (converter, required), with the lookups precompiled
+    into one operator.itemgetter so parse_form fetches every field at once."""
+
+    __slots__ = ("names", "rules", "getter")
+
+    def __init__(self, fields: Dict[str, Tuple[Callable[[str], Any], bool]]) -> None:
+        self.names = tuple(fields)
+        self.rules = tuple(fields.values())
+        if len(self.names) == 1:
+            # itemgetter with one key returns the bare value, not a 1-tuple
+            name = self.names[0]
+            self.getter = lambda d: (d[name],)
+        else:
+            self.getter = operator.itemgetter(*self.names)
+
+
+PATIENT_FIELDS = FormSpec({
+    "usn": (str, True),
+    "full_name": (str, True),
+    "age": (int, True),
+    "gender": (str, True),
+    "contact": (str, True),
+    "address": (str, True),
+})
+
+VITALS_FIELDS = FormSpec({
+    "usn": (str, True),
+    "weight": (float, True),
+    "height": (float, True),
+    "blood_pressure_systolic": (int, True),
+    "blood_pressure_diastolic": (int, True),
+    "heart_rate": (int, True),
+    "temperature": (float, True),
+    "respiratory_rate": (int, False),
+    "oxygen_saturation": (int, False),
+    "notes": (str, False),
+})
+
+LEGACY_VITALS_FIELDS = FormSpec({
+    "usn": (str, True),
+    "blood_pressure": (str, True),
+    "pulse": (int, True),
+    "temperature": (float, True),
+    "weight": (float, True),
+    "height": (float, True),
+})
+
+RX_ITEM_FIELDS = FormSpec({
+    "prescription_id": (int, True),
+    "med_name": (str, True),
+    "dose": (str, False),
+    "route": (str, False),
+    "frequency": (str, False),
+    "duration_days": (str, False),
+    "instructions": (str, False),
+})
+
+
+def parse_form(form: Any, spec: FormSpec) -> Dict[str, Any]:
+    """Strip and convert form fields in one pass.
+
+    Raises KeyError for a missing required field and ValueError when a
+    value fails conversion. Empty optional fields come back as None.
+    """
+    # absent fields read as "" so the single itemgetter call never raises
+    values = spec.getter(defaultdict(str, form.to_dict()))
+    out: Dict[str, Any] = {}
+    for name, value, (conv, required) in zip(spec.names, values, spec.rules):
+        raw = value.strip()
+        if not raw:
+            if required:
+                raise KeyError(name)
+            out[name] = None
+        else:
+            out[name] = conv(raw)
+    return out
+
+
 # --- Routes ---
 
 @app.get("/")
 def index() -> str:
     q = (request.args.get("q") or "").strip()
-    conn = get_db()
+    conn = get_db(readonly=True)
 
-    patients: List[sqlite3.Row] = conn.execute(
-        "SELECT * FROM patients ORDER BY full_name COLLATE NOCASE"
-    ).fetchall()
+    cursor = request.args.get("cursor")
+    cursor_usn = request.args.get("cursor_usn") or ""
+    # Fetch one extra row to learn whether a next page exists
+    if cursor is None:
+        patients: List[sqlite3.Row] = conn.execute(SQL_PATIENTS_PAGE, (PATIENTS_PAGE_SIZE + 1,)).fetchall()
+    else:
+        patients = conn.execute(
+            SQL_PATIENTS_PAGE_AFTER, (cursor, cursor_usn, PATIENTS_PAGE_SIZE + 1)
+        ).fetchall()
+    next_cursor: Optional[Tuple[str, str]] = None
+    if len(patients) > PATIENTS_PAGE_SIZE:
+        patients = patients[:PATIENTS_PAGE_SIZE]
+        next_cursor = (patients[-1]["full_name"], patients[-1]["usn"])
 
     match_patient: Optional[sqlite3.Row] = None
     patient_vitals: List[sqlite3.Row] = []
     patient_rx: List[sqlite3.Row] = []
 
     if q:
-        match_patient = conn.execute(
-            "SELECT * FROM patients WHERE usn = ? OR contact = ?",
-            (q, q),
-        ).fetchone()
+        match_patient = conn.execute(SQL_FIND_PATIENT, (q, q)).fetchone()
         if match_patient:
-            patient_vitals = conn.execute(
-                "SELECT * FROM vitals WHERE usn = ? ORDER BY recorded_at DESC",
-                (match_patient["usn"],),
-            ).fetchall()
-            patient_rx = conn.execute(
-                "SELECT * FROM prescriptions WHERE usn = ? ORDER BY prescribed_at DESC",
-                (match_patient["usn"],),
-            ).fetchall()
+            patient_vitals = conn.execute(SQL_VITALS_BY_USN, (match_patient["usn"],)).fetchall()
+            patient_rx = conn.execute(SQL_RX_BY_USN, (match_patient["usn"],)).fetchall()
 
     return render_template(
         "index.html",
         patients=patients,
+        next_cursor=next_cursor,
+        paged=cursor is not None,
         q=q,
         match_patient=match_patient,
         patient_vitals=patient_vitals,
@@ -304,113 +853,77 @@ def index() -> str:
 # Patient create/update/delete
 @app.post("/patient/create")
 def patient_create() -> Response:
-    data = {k: (request.form.get(k) or "").strip() for k in [
-        "usn", "full_name", "age", "gender", "contact", "address"
-    ]}
-    if not all(data.values()):
-        return redirect(url_for("index", e="All patient fields are required"))
-
     try:
-        age = int(data["age"]) if data["age"] else 0
+        data = parse_form(request.form, PATIENT_FIELDS)
+    except KeyError:
+        return redirect(url_for("index", e="All patient fields are required"))
     except ValueError:
         return redirect(url_for("index", e="Age must be a number"))
 
     conn = get_db()
     try:
-        conn.execute(
-            "INSERT INTO patients(usn, full_name, age, gender, contact, address) VALUES(?,?,?,?,?,?)",
-            (data["usn"], data["full_name"], age, data["gender"], data["contact"], data["address"]),
-        )
-        conn.commit()
+        with conn:
+            conn.execute(
+                SQL_INSERT_PATIENT,
+                (data["usn"], data["full_name"], data["age"], data["gender"], data["contact"], data["address"]),
+            )
     except sqlite3.IntegrityError:
         return redirect(url_for("index", e="USN must be unique"))
-    finally:
-        conn.close()
 
     return redirect(url_for("index", m="Patient created"))
 
 
 @app.post("/patient/update")
 def patient_update() -> Response:
-    usn = (request.form.get("usn") or "").strip()
-    full_name = (request.form.get("full_name") or "").strip()
-    contact = (request.form.get("contact") or "").strip()
-    address = (request.form.get("address") or "").strip()
-    gender = (request.form.get("gender") or "").strip()
-    age_raw = (request.form.get("age") or "").strip()
-
-    if not (usn and full_name and contact and address and gender and age_raw):
-        return redirect(url_for("index", e="All fields required for update"))
-
     try:
-        age = int(age_raw)
+        data = parse_form(request.form, PATIENT_FIELDS)
+    except KeyError:
+        return redirect(url_for("index", e="All fields required for update"))
     except ValueError:
         return redirect(url_for("index", e="Age must be a number"))
+    usn = data["usn"]
 
     conn = get_db()
-    cur = conn.cursor()
-    cur.execute(
-        "UPDATE patients SET full_name=?, age=?, gender=?, contact=?, address=? WHERE usn=?",
-        (full_name, age, gender, contact, address, usn),
-    )
-    conn.commit()
-    conn.close()
+    with conn:
+        conn.execute(
+            "UPDATE patients SET full_name=?, age=?, gender=?, contact=?, address=? WHERE usn=?",
+            (data["full_name"], data["age"], data["gender"], data["contact"], data["address"], usn),
+        )
     return redirect(url_for("index", m="Patient updated", q=usn))
 
 
 @app.post("/patient/delete/<usn>")
 def patient_delete(usn: str) -> Response:
     conn = get_db()
-    conn.execute("DELETE FROM patients WHERE usn=?", (usn,))
-    conn.commit()
-    conn.close()
+    with conn:
+        conn.execute("DELETE FROM patients WHERE usn=?", (usn,))
     return redirect(url_for("index", m="Patient deleted"))
 
 
 # Vitals
 @app.post("/vitals/create")
 def vitals_create() -> Response:
-    usn = (request.form.get("usn") or "").strip()
-    weight = (request.form.get("weight") or "0").strip()
-    height = (request.form.get("height") or "0").strip()
-    bp_systolic = (request.form.get("blood_pressure_systolic") or "0").strip()
-    bp_diastolic = (request.form.get("blood_pressure_diastolic") or "0").strip()
-    heart_rate = (request.form.get("heart_rate") or "0").strip()
-    temperature = (request.form.get("temperature") or "0").strip()
-    respiratory_rate = (request.form.get("respiratory_rate") or "").strip()
-    oxygen_saturation = (request.form.get("oxygen_saturation") or "").strip()
-    notes = (request.form.get("notes") or "").strip()
-
-    if not (usn and weight and height and bp_systolic and bp_diastolic and heart_rate and temperature):
-        return redirect(url_for("index", e="Required vitals fields missing", q=usn))
-
     try:
-        weight_f = float(weight)
-        height_f = float(height)
-        bp_sys_i = int(bp_systolic)
-        bp_dia_i = int(bp_diastolic)
-        hr_i = int(heart_rate)
-        temp_f = float(temperature)
-        resp_rate_i = int(respiratory_rate) if respiratory_rate else None
-        o2_sat_i = int(oxygen_saturation) if oxygen_saturation else None
+        v = parse_form(request.form, VITALS_FIELDS)
+    except KeyError:
+        return redirect(url_for("index", e="Required vitals fields missing", q=request.form.get("usn", "").strip()))
     except ValueError:
-        return redirect(url_for("index", e="Vitals must be numeric", q=usn))
+        return redirect(url_for("index", e="Vitals must be numeric", q=request.form.get("usn", "").strip()))
+    usn = v["usn"]
 
     conn = get_db()
-    # Ensure patient exists
-    p = conn.execute("SELECT 1 FROM patients WHERE usn=?", (usn,)).fetchone()
-    if not p:
-        conn.close()
+    try:
+        with conn:
+            conn.execute(
+                SQL_INSERT_VITALS,
+                (
+                    usn, v["weight"], v["height"], v["blood_pressure_systolic"], v["blood_pressure_diastolic"],
+                    v["heart_rate"], v["temperature"], v["respiratory_rate"], v["oxygen_saturation"], v["notes"],
+                ),
+            )
+    except sqlite3.IntegrityError:
+        # Foreign key failure: no such patient
         return redirect(url_for("index", e="Patient not found", q=usn))
-
-    conn.execute(
-        """INSERT INTO vitals(usn, weight, height, blood_pressure_systolic, blood_pressure_diastolic, 
-           heart_rate, temperature, respiratory_rate, oxygen_saturation, notes, recorded_at) 
-           VALUES(?,?,?,?,?,?,?,?,?,?,?)""",
-        (usn, weight_f, height_f, bp_sys_i, bp_dia_i, hr_i, temp_f, resp_rate_i, o2_sat_i, notes, datetime.utcnow().isoformat()),
-    )
-    conn.commit()
-    conn.close()
     return redirect(url_for("index", m="Vitals saved", q=usn))
 
 
@@ -418,10 +931,8 @@ def vitals_create() -> Response:
 @app.route("/api/patients", methods=["GET", "POST"])
 def api_patients():
     if request.method == "GET":
-        conn = get_db()
-        patients = conn.execute("SELECT * FROM patients ORDER BY full_name").fetchall()
-        conn.close()
-        return jsonify([dict(row) for row in patients])
+        conn = get_db(readonly=True)
+        return jsonify(query_dicts(conn, SQL_LIST_PATIENTS))
     
     elif request.method == "POST":
         data = request.get_json()
@@ -443,32 +954,30 @@ def api_patients():
 
         conn = get_db()
         try:
-            conn.execute(
-                "INSERT INTO patients(usn, full_name, age, gender, contact, address) VALUES(?,?,?,?,?,?)",
-                (usn, full_name, age, gender, contact or "", address or ""),
-            )
-            conn.commit()
+            with conn:
+                conn.execute(
+                    SQL_INSERT_PATIENT,
+                    (usn, full_name, age, gender, contact or "", address or ""),
+                )
             return jsonify({"message": "Patient created successfully"}), 201
         except sqlite3.IntegrityError:
             return jsonify({"error": "USN already exists"}), 409
-        finally:
-            conn.close()
 
 
 @app.route("/api/vitals", methods=["GET", "POST"])
 def api_vitals():
     if request.method == "GET":
         usn = request.args.get("usn")
-        conn = get_db()
-        if usn:
-            vitals = conn.execute(
-                "SELECT * FROM vitals WHERE usn=? ORDER BY recorded_at DESC", 
-                (usn,)
-            ).fetchall()
-        else:
-            vitals = conn.execute("SELECT * FROM vitals ORDER BY recorded_at DESC").fetchall()
-        conn.close()
-        return jsonify([dict(row) for row in vitals])
+
+        def build() -> Any:
+            conn = get_db(readonly=True)
+            if usn:
+                vitals = query_dicts(conn, SQL_VITALS_BY_USN, (usn,))
+            else:
+                vitals = query_dicts(conn, SQL_LIST_VITALS)
+            return vitals
+
+        return cached_json(("vitals", usn or ""), build)
     
     elif request.method == "POST":
         data = request.get_json()
@@ -492,142 +1001,196 @@ def api_vitals():
             return jsonify({"error": "Invalid numeric values"}), 400
 
         conn = get_db()
-        # Check if patient exists
-        patient = conn.execute("SELECT 1 FROM patients WHERE usn=?", (usn,)).fetchone()
-        if not patient:
-            conn.close()
+        try:
+            with conn:
+                conn.execute(
+                    SQL_INSERT_VITALS,
+                    (usn, weight, height, bp_sys, bp_dia, heart_rate, temperature, resp_rate, o2_sat, notes),
+                )
+        except sqlite3.IntegrityError:
+            # Foreign key failure: no such patient
             return jsonify({"error": "Patient not found"}), 404
+        return jsonify({"message": "Vitals recorded successfully"}), 201
 
-        try:
-            conn.execute(
-                """INSERT INTO vitals(usn, weight, height, blood_pressure_systolic, blood_pressure_diastolic, 
-                   heart_rate, temperature, respiratory_rate, oxygen_saturation, notes, recorded_at) 
-                   VALUES(?,?,?,?,?,?,?,?,?,?,?)""",
-                (usn, weight, height, bp_sys, bp_dia, heart_rate, temperature, resp_rate, o2_sat, notes, datetime.utcnow().isoformat()),
-            )
-            conn.commit()
-            return jsonify({"message": "Vitals recorded successfully"}), 201
-        finally:
-            conn.close()
+
+@app.get("/api/vitals/stats")
+def api_vitals_stats():
+    """Count plus avg/min/max of each VITALS_STAT_COLUMNS entry, optionally for one usn."""
+    usn = request.args.get("usn")
+
+    def build() -> Any:
+        conn = get_db(readonly=True)
+        if usn:
+            row = conn.execute(SQL_VITALS_STATS_BY_USN, (usn,)).fetchone()
+        else:
+            row = conn.execute(SQL_VITALS_STATS).fetchone()
+        count, latest = row[0], row[1]
+        stats: Dict[str, Any] = {"count": count, "latest": latest}
+        for i, col in enumerate(VITALS_STAT_COLUMNS):
+            avg, lo, hi = row[2 + 3 * i:5 + 3 * i]
+            stats[col] = {"avg": avg, "min": lo, "max": hi}
+        return stats
+
+    return cached_json(("vitals_stats", usn or ""), build)
+
+
+def _bulk_patient_row(d: Dict[str, Any]) -> Tuple[Any, ...]:
+    usn, full_name, gender = d["usn"].strip(), d["fullName"].strip(), d["gender"].strip()
+    if not (usn and full_name and gender):
+        raise ValueError("Required fields missing")
+    return (
+        usn, full_name, int(d["age"]), gender,
+        (d.get("phone") or "").strip(), (d.get("address") or "").strip(),
+    )
+
+
+def _bulk_vitals_row(d: Dict[str, Any]) -> Tuple[Any, ...]:
+    usn = d["usn"].strip()
+    if not usn:
+        raise ValueError("usn required")
+    return (
+        usn, float(d["weight"]), float(d["height"]),
+        int(d["bloodPressureSystolic"]), int(d["bloodPressureDiastolic"]),
+        int(d["heartRate"]), float(d["temperature"]),
+        int(d["respiratoryRate"]) if d.get("respiratoryRate") else None,
+        int(d["oxygenSaturation"]) if d.get("oxygenSaturation") else None,
+        (d.get("notes") or "").strip(),
+    )
+
+
+# Bulk ingest: one executemany in one transaction per request
+@app.post("/api/patients/bulk")
+def api_patients_bulk():
+    data = request.get_json(silent=True)
+    if not isinstance(data, list):
+        return jsonify({"error": "Expected a JSON array of patients"}), 400
+    try:
+        rows = [_bulk_patient_row(d) for d in data]
+    except (KeyError, ValueError, TypeError, AttributeError):
+        return jsonify({"error": "Invalid or missing patient fields"}), 400
+
+    conn = get_db()
+    try:
+        with conn:
+            conn.executemany(SQL_INSERT_PATIENT, rows)
+    except sqlite3.IntegrityError:
+        return jsonify({"error": "USN already exists"}), 409
+    return jsonify({"inserted": len(rows)}), 201
+
+
+@app.post("/api/vitals/bulk")
+def api_vitals_bulk():
+    data = request.get_json(silent=True)
+    if not isinstance(data, list):
+        return jsonify({"error": "Expected a JSON array of vitals"}), 400
+    try:
+        rows = [_bulk_vitals_row(d) for d in data]
+    except (KeyError, ValueError, TypeError, AttributeError):
+        return jsonify({"error": "Invalid or missing vitals fields"}), 400
+
+    conn = get_db()
+    try:
+        with conn:
+            conn.executemany(SQL_INSERT_VITALS, rows)
+    except sqlite3.IntegrityError:
+        # Foreign key failure: at least one USN has no patient
+        return jsonify({"error": "Patient not found"}), 404
+    return jsonify({"inserted": len(rows)}), 201
+
+
+@app.post("/api/import/patients")
+def api_import_patients():
+    """Load patients from a CSV laid out like /api/export/patients.
+
+    Accepts a multipart upload in the "file" field or a raw text/csv body.
+    Rows are read from the upload stream and inserted in IMPORT_BATCH_SIZE
+    batches, all in one transaction.
+    """
+    upload = request.files.get("file")
+    raw = upload.stream if upload else request.stream
+    # iterdecode rather than TextIOWrapper: before Python 3.11 the spooled
+    # temp file behind multipart uploads lacks readable() and can't be wrapped
+    reader = csv.reader(codecs.iterdecode(raw, "utf-8-sig"))
+
+    inserted = 0
+    conn = get_db()
+    try:
+        # Decoding is lazy, so bad bytes can surface on any row, header included
+        first = next(reader, None)
+        if first is None:
+            return jsonify({"error": "Empty CSV"}), 400
+        if first and first[0].strip().upper() == "USN":
+            first = None  # header row
+        rows = itertools.chain([first] if first else [], reader)
+
+        with write_txn(conn):
+            while True:
+                batch = [
+                    (r[0].strip(), r[1].strip(), int(r[2]), r[3].strip(), r[4].strip(), r[5].strip())
+                    for r in itertools.islice(rows, IMPORT_BATCH_SIZE)
+                    if r
+                ]
+                if not batch:
+                    break
+                conn.executemany(SQL_INSERT_PATIENT, batch)
+                inserted += len(batch)
+    except UnicodeDecodeError:
+        return jsonify({"error": "CSV must be UTF-8 encoded"}), 400
+    except csv.Error as e:
+        return jsonify({"error": f"Malformed CSV: {e}"}), 400
+    except (IndexError, ValueError):
+        return jsonify({"error": "Each row needs USN, Full Name, numeric Age, Gender, Contact, Address"}), 400
+    except sqlite3.IntegrityError:
+        return jsonify({"error": "USN already exists"}), 409
+    return jsonify({"inserted": inserted}), 201
 
 
 @app.route("/api/export/patients")
 def api_export_patients():
-    conn = get_db()
-    patients = conn.execute("SELECT * FROM patients ORDER BY full_name").fetchall()
-    conn.close()
-    
-    output = io.StringIO()
-    writer = csv.writer(output)
-    
-    # Write header
-    writer.writerow(["USN", "Full Name", "Age", "Gender", "Contact", "Address"])
-    
-    # Write data
-    for patient in patients:
-        writer.writerow([patient["usn"], patient["full_name"], patient["age"], 
-                        patient["gender"], patient["contact"], patient["address"]])
-    
-    response = Response(output.getvalue(), mimetype="text/csv")
-    response.headers["Content-Disposition"] = "attachment; filename=patients.csv"
-    return response
+    conn = get_db(readonly=True)
+    rows = execute_raw(conn, SQL_EXPORT_PATIENTS)
+    return stream_csv(["USN", "Full Name", "Age", "Gender", "Contact", "Address"], rows, "patients.csv")
 
 
 @app.route("/api/export/vitals")
 def api_export_vitals():
-    conn = get_db()
-    vitals = conn.execute("""
-        SELECT v.*, p.full_name 
-        FROM vitals v 
-        JOIN patients p ON v.usn = p.usn 
-        ORDER BY v.recorded_at DESC
-    """).fetchall()
-    conn.close()
-    
-    output = io.StringIO()
-    writer = csv.writer(output)
-    
-    # Write header
-    writer.writerow(["USN", "Patient Name", "Weight (kg)", "Height (cm)", "BMI", 
-                    "Systolic BP", "Diastolic BP", "Heart Rate", "Temperature", 
-                    "Respiratory Rate", "Oxygen Saturation", "Notes", "Recorded At"])
-    
-    # Write data
-    for vital in vitals:
-        writer.writerow([
-            vital["usn"], vital["full_name"], vital["weight"], vital["height"],
-            vital["bmi"], vital["blood_pressure_systolic"], vital["blood_pressure_diastolic"],
-            vital["heart_rate"], vital["temperature"], vital["respiratory_rate"],
-            vital["oxygen_saturation"], vital["notes"], vital["recorded_at"]
-        ])
-    
-    response = Response(output.getvalue(), mimetype="text/csv")
-    response.headers["Content-Disposition"] = "attachment; filename=vitals.csv"
-    return response
+    conn = get_db(readonly=True)
+    rows = execute_raw(conn, SQL_EXPORT_VITALS)
+    header = ["USN", "Patient Name", "Weight (kg)", "Height (cm)", "BMI",
+              "Systolic BP", "Diastolic BP", "Heart Rate", "Temperature",
+              "Respiratory Rate", "Oxygen Saturation", "Notes", "Recorded At"]
+    return stream_csv(header, rows, "vitals.csv")
 
 
 @app.route("/api/export/complete")
 def api_export_complete():
-    conn = get_db()
+    conn = get_db(readonly=True)
     
     # Get comprehensive patient data
-    patients_data = conn.execute("""
-        SELECT 
-            p.*,
-            v.weight as latest_weight,
-            v.height as latest_height,
-            v.bmi as latest_bmi,
-            v.blood_pressure_systolic || '/' || v.blood_pressure_diastolic as latest_bp,
-            v.heart_rate as latest_hr,
-            v.temperature as latest_temp,
-            (SELECT COUNT(*) FROM vitals WHERE usn = p.usn) as total_vitals,
-            (SELECT COUNT(*) FROM prescriptions WHERE usn = p.usn) as total_prescriptions
-        FROM patients p
-        LEFT JOIN vitals v ON p.usn = v.usn AND v.id = (
-            SELECT id FROM vitals WHERE usn = p.usn ORDER BY recorded_at DESC LIMIT 1
-        )
-        ORDER BY p.full_name
-    """).fetchall()
-    conn.close()
-    
-    output = io.StringIO()
-    writer = csv.writer(output)
-    
-    # Write header
-    writer.writerow([
+    rows = execute_raw(conn, SQL_EXPORT_COMPLETE)
+
+    header = [
         "USN", "Full Name", "Age", "Gender", "Contact", "Address",
         "Latest Weight", "Latest Height", "Latest BMI", "Latest BP",
         "Latest Heart Rate", "Latest Temperature", "Total Vitals Records", "Total Prescriptions"
-    ])
-    
-    # Write data
-    for row in patients_data:
-        writer.writerow([
-            row["usn"], row["full_name"], row["age"], row["gender"],
-            row["contact"], row["address"], row["latest_weight"], row["latest_height"],
-            row["latest_bmi"], row["latest_bp"], row["latest_hr"], row["latest_temp"],
-            row["total_vitals"], row["total_prescriptions"]
-        ])
-    
-    response = Response(output.getvalue(), mimetype="text/csv")
-    response.headers["Content-Disposition"] = "attachment; filename=complete_patient_data.csv"
-    return response
+    ]
+    return stream_csv(header, rows, "complete_patient_data.csv")
 
 
 @app.route("/api/prescriptions", methods=["GET", "POST"])
 def api_prescriptions():
     if request.method == "GET":
         usn = request.args.get("usn")
-        conn = get_db()
-        if usn:
-            prescriptions = conn.execute(
-                "SELECT * FROM prescriptions WHERE usn=? ORDER BY prescribed_at DESC", 
-                (usn,)
-            ).fetchall()
-        else:
-            prescriptions = conn.execute("SELECT * FROM prescriptions ORDER BY prescribed_at DESC").fetchall()
-        conn.close()
-        return jsonify([dict(row) for row in prescriptions])
+
+        def build() -> Any:
+            conn = get_db(readonly=True)
+            if usn:
+                prescriptions = query_dicts(conn, SQL_RX_BY_USN, (usn,))
+            else:
+                prescriptions = query_dicts(conn, SQL_LIST_RX)
+            return prescriptions
+
+        return cached_json(("prescriptions", usn or ""), build)
     
     elif request.method == "POST":
         data = request.get_json()
@@ -640,111 +1203,83 @@ def api_prescriptions():
         if not usn or not diagnosis:
             return jsonify({"error": "USN and diagnosis are required"}), 400
 
-        conn = get_db()
-        # Check if patient exists
-        patient = conn.execute("SELECT * FROM patients WHERE usn=?", (usn,)).fetchone()
-        if not patient:
-            conn.close()
-            return jsonify({"error": "Patient not found"}), 404
+        # Create comprehensive prescription notes
+        parts = [f"Diagnosis: {diagnosis}\n\n"]
+        if medications:
+            parts.append("Medications:\n")
+            for i, med in enumerate(medications, 1):
+                name, dosage, frequency = med.get('name'), med.get('dosage'), med.get('frequency')
+                if name and dosage and frequency:
+                    parts.append(f"{i}. {name} - {dosage}, {frequency}")
+                    if med.get('duration'):
+                        parts.append(f", for {med['duration']}")
+                    if med.get('instructions'):
+                        parts.append(f" ({med['instructions']})")
+                    parts.append("\n")
+
+        if notes:
+            parts.append(f"\nAdditional Notes: {notes}")
+
+        if follow_up_date:
+            parts.append(f"\nFollow-up Date: {follow_up_date}")
+        prescription_notes = "".join(parts)
 
+        conn = get_db()
         try:
-            # Create comprehensive prescription notes
-            prescription_notes = f"Diagnosis: {diagnosis}\n\n"
-            if medications:
-                prescription_notes += "Medications:\n"
-                for i, med in enumerate(medications, 1):
-                    if med.get('name') and med.get('dosage') and med.get('frequency'):
-                        prescription_notes += f"{i}. {med['name']} - {med['dosage']}, {med['frequency']}"
-                        if med.get('duration'):
-                            prescription_notes += f", for {med['duration']}"
-                        if med.get('instructions'):
-                            prescription_notes += f" ({med['instructions']})"
-                        prescription_notes += "\n"
-            
-            if notes:
-                prescription_notes += f"\nAdditional Notes: {notes}"
-            
-            if follow_up_date:
-                prescription_notes += f"\nFollow-up Date: {follow_up_date}"
-
-            conn.execute(
-                "INSERT INTO prescriptions(usn, notes, prescribed_at) VALUES(?,?,?)",
-                (usn, prescription_notes, datetime.utcnow().isoformat()),
-            )
-            conn.commit()
-            return jsonify({"message": "Prescription created successfully"}), 201
-        finally:
-            conn.close()
+            with conn:
+                conn.execute(
+                    SQL_INSERT_RX,
+                    (usn, prescription_notes),
+                )
+        except sqlite3.IntegrityError:
+            # Foreign key failure: no such patient
+            return jsonify({"error": "Patient not found"}), 404
+        return jsonify({"message": "Prescription created successfully"}), 201
 
 
 @app.route("/api/export/prescriptions")
 def api_export_prescriptions():
-    conn = get_db()
-    prescriptions = conn.execute("""
-        SELECT p.*, pa.full_name 
-        FROM prescriptions p 
-        JOIN patients pa ON p.usn = pa.usn 
-        ORDER BY p.prescribed_at DESC
-    """).fetchall()
-    conn.close()
-    
-    output = io.StringIO()
-    writer = csv.writer(output)
-    
-    # Write header
-    writer.writerow(["USN", "Patient Name", "Prescription Notes", "Prescribed At"])
-    
-    # Write data
-    for prescription in prescriptions:
-        writer.writerow([
-            prescription["usn"], prescription["full_name"], 
-            prescription["notes"], prescription["prescribed_at"]
-        ])
-    
-    response = Response(output.getvalue(), mimetype="text/csv")
-    response.headers["Content-Disposition"] = "attachment; filename=prescriptions.csv"
-    return response
+    conn = get_db(readonly=True)
+    rows = execute_raw(conn, SQL_EXPORT_RX)
+    return stream_csv(["USN", "Patient Name", "Prescription Notes", "Prescribed At"], rows, "prescriptions.csv")
 
 
 @app.route("/api/health")
 def api_health():
-    return jsonify({"status": "ok", "timestamp": datetime.utcnow().isoformat()})
+    def build() -> Any:
+        now = datetime.utcnow().isoformat()
+        return {"status": "ok", "timestamp": now}
+
+    return cached_json(("health", ""), build)
 
 
 # Original vitals creation for backward compatibility (keeping old endpoint)
 @app.post("/vitals/create/legacy")
 def vitals_create_legacy() -> Response:
-    usn = (request.form.get("usn") or "").strip()
-    bp = (request.form.get("blood_pressure") or "").strip()
-    pulse = (request.form.get("pulse") or "0").strip()
-    temp = (request.form.get("temperature") or "0").strip()
-    weight = (request.form.get("weight") or "0").strip()
-    height = (request.form.get("height") or "0").strip()
-
-    if not (usn and bp and pulse and temp and weight and height):
-        return redirect(url_for("index", e="All vitals are required", q=usn))
-
     try:
-        pulse_i = int(pulse)
-        temp_f = float(temp)
-        weight_f = float(weight)
-        height_f = float(height)
+        v = parse_form(request.form, LEGACY_VITALS_FIELDS)
+    except KeyError:
+        return redirect(url_for("index", e="All vitals are required", q=request.form.get("usn", "").strip()))
+    except ValueError:
+        return redirect(url_for("index", e="Vitals must be numeric", q=request.form.get("usn", "").strip()))
+    usn = v["usn"]
+    # The legacy form sends "120/80" and "pulse"; map them onto the split
+    # systolic/diastolic and heart_rate columns, as /export.csv joins them back
+    try:
+        systolic, diastolic = (int(part) for part in v["blood_pressure"].split("/"))
     except ValueError:
         return redirect(url_for("index", e="Vitals must be numeric", q=usn))
 
     conn = get_db()
-    # Ensure patient exists
-    p = conn.execute("SELECT 1 FROM patients WHERE usn=?", (usn,)).fetchone()
-    if not p:
-        conn.close()
+    try:
+        with conn:
+            conn.execute(
+                SQL_INSERT_VITALS,
+                (usn, v["weight"], v["height"], systolic, diastolic, v["pulse"], v["temperature"], None, None, None),
+            )
+    except sqlite3.IntegrityError:
+        # Foreign key failure: no such patient
         return redirect(url_for("index", e="Patient not found", q=usn))
-
-    conn.execute(
-        "INSERT INTO vitals(usn, blood_pressure, pulse, temperature, weight, height, recorded_at) VALUES(?,?,?,?,?,?,?)",
-        (usn, bp, pulse_i, temp_f, weight_f, height_f, datetime.utcnow().isoformat()),
-    )
-    conn.commit()
-    conn.close()
     return redirect(url_for("index", m="Vitals saved", q=usn))
 
 
@@ -757,71 +1292,65 @@ def prescription_create() -> Response:
         return redirect(url_for("index", e="USN and notes required", q=usn))
 
     conn = get_db()
-    p = conn.execute("SELECT 1 FROM patients WHERE usn=?", (usn,)).fetchone()
-    if not p:
-        conn.close()
+    try:
+        with conn:
+            conn.execute(
+                SQL_INSERT_RX,
+                (usn, notes),
+            )
+    except sqlite3.IntegrityError:
+        # Foreign key failure: no such patient
         return redirect(url_for("index", e="Patient not found", q=usn))
-
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO prescriptions(usn, notes, prescribed_at) VALUES(?,?,?)",
-        (usn, notes, datetime.utcnow().isoformat()),
-    )
-    rx_id = cur.lastrowid
-    conn.commit()
-    conn.close()
     return redirect(url_for("index", m="Prescription saved", q=usn))
 
 
 # New: add itemized medications to a prescription
 @app.post("/prescription/item/create")
 def prescription_item_create() -> Response:
-    prescription_id = (request.form.get("prescription_id") or "").strip()
-    med_name = (request.form.get("med_name") or "").strip()
-    dose = (request.form.get("dose") or "").strip()
-    route = (request.form.get("route") or "").strip()
-    frequency = (request.form.get("frequency") or "").strip()
-    duration_days = (request.form.get("duration_days") or "").strip()
-    instructions = (request.form.get("instructions") or "").strip()
-
-    if not (prescription_id and med_name):
+    try:
+        item = parse_form(request.form, RX_ITEM_FIELDS)
+    except (KeyError, ValueError):
         return redirect(url_for("index", e="Prescription and medication required"))
 
-    conn = get_db()
-    cur = conn.cursor()
-    # Upsert medication by name
-    med = cur.execute("SELECT id FROM medications WHERE name=?", (med_name,)).fetchone()
-    if med:
-        med_id = med["id"]
-    else:
-        cur.execute("INSERT INTO medications(name) VALUES(?)", (med_name,))
-        med_id = cur.lastrowid
-
     try:
-        dur_i = int(duration_days) if duration_days else None
+        dur_i = int(item["duration_days"]) if item["duration_days"] else None
     except ValueError:
         dur_i = None
 
-    cur.execute(
-        """
-        INSERT INTO prescription_items(prescription_id, medication_id, dose, route, frequency, duration_days, instructions)
-        VALUES (?,?,?,?,?,?,?)
-        """,
-        (int(prescription_id), med_id, dose, route, frequency, dur_i, instructions or None),
-    )
-    conn.commit()
-    conn.close()
+    conn = get_db()
+    try:
+        with write_txn(conn):
+            # Upsert medication by name
+            med_id = conn.execute(
+                """
+                INSERT INTO medications(name) VALUES(?)
+                ON CONFLICT(name) WHERE strength IS NULL AND form IS NULL
+                DO UPDATE SET name = excluded.name
+                RETURNING id
+                """,
+                (item["med_name"],),
+            ).fetchone()[0]
+
+            conn.execute(
+                """
+                INSERT INTO prescription_items(prescription_id, medication_id, dose, route, frequency, duration_days, instructions)
+                VALUES (?,?,?,?,?,?,?)
+                """,
+                (item["prescription_id"], med_id, item["dose"], item["route"], item["frequency"], dur_i, item["instructions"]),
+            )
+    except sqlite3.IntegrityError:
+        # Foreign key failure: no such prescription; the upsert rolls back too
+        return redirect(url_for("index", e="Prescription not found"))
     return redirect(url_for("index", m="Medication added to prescription"))
 
 
 @app.get("/prescription/print/<int:pid>")
 def prescription_print(pid: int) -> str:
-    conn = get_db()
+    conn = get_db(readonly=True)
     rx = conn.execute("SELECT * FROM prescriptions WHERE id=?", (pid,)).fetchone()
     if not rx:
-        conn.close()
         return "Not Found", 404
-    patient = conn.execute("SELECT * FROM patients WHERE usn=?", (rx["usn"],)).fetchone()
+    patient = conn.execute(SQL_GET_PATIENT, (rx["usn"],)).fetchone()
     items = conn.execute(
         """
         SELECT pi.*, m.name AS medication_name
@@ -832,7 +1361,6 @@ def prescription_print(pid: int) -> str:
         """,
         (pid,),
     ).fetchall()
-    conn.close()
     return render_template("print_rx.html", rx=rx, patient=patient, items=items)
 
 
@@ -840,18 +1368,16 @@ def prescription_print(pid: int) -> str:
 @app.get("/api/appointments")
 def api_appointments_list() -> Response:
     usn = (request.args.get("usn") or "").strip()
-    conn = get_db()
-    if usn:
-        rows = conn.execute(
-            "SELECT * FROM appointments WHERE usn = ? ORDER BY starts_at DESC",
-            (usn,),
-        ).fetchall()
-    else:
-        rows = conn.execute(
-            "SELECT * FROM appointments ORDER BY starts_at DESC LIMIT 200"
-        ).fetchall()
-    conn.close()
-    return jsonify([dict(r) for r in rows])
+    try:
+        page = page_args()
+    except ValueError:
+        return jsonify({"error": "before_id and limit must be integers"}), 400
+    sql = SQL_APPTS_PAGE_BY_USN if usn else SQL_APPTS_PAGE
+    return cached_json(
+        ("appointments", repr((usn, *page.values()))),
+        lambda: query_dicts(get_db(readonly=True), sql, {**page, "usn": usn}),
+        None,
+    )
 
 
 @app.post("/api/appointments")
@@ -868,23 +1394,14 @@ def api_appointments_create() -> Response:
         return jsonify({"error": "usn, starts_at, ends_at required"}), 400
 
     conn = get_db()
-    p = conn.execute("SELECT 1 FROM patients WHERE usn=?", (usn,)).fetchone()
-    if not p:
-        conn.close()
+    with conn:
+        row = conn.execute(
+            SQL_INSERT_APPT,
+            (usn, starts_at, ends_at, title, clinician, notes),
+        ).fetchone()
+    if row is None:
         return jsonify({"error": "Patient not found"}), 404
-
-    cur = conn.cursor()
-    cur.execute(
-        """
-        INSERT INTO appointments(usn, starts_at, ends_at, status, title, clinician, notes)
-        VALUES (?,?,?,?,?,?,?)
-        """,
-        (usn, starts_at, ends_at, "Scheduled", title, clinician, notes),
-    )
-    appt_id = cur.lastrowid
-    conn.commit()
-    conn.close()
-    return jsonify({"id": appt_id}), 201
+    return jsonify({"id": row[0]}), 201
 
 
 @app.post("/api/appointments/<int:aid>/update")
@@ -898,108 +1415,72 @@ def api_appointments_update(aid: int) -> Response:
     ends_at = (data.get("ends_at") or "").strip() or None
 
     conn = get_db()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        UPDATE appointments
-        SET status = COALESCE(?, status),
-            title = COALESCE(?, title),
-            clinician = COALESCE(?, clinician),
-            notes = COALESCE(?, notes),
-            starts_at = COALESCE(?, starts_at),
-            ends_at = COALESCE(?, ends_at)
-        WHERE id = ?
-        """,
-        (status, title, clinician, notes, starts_at, ends_at, aid),
-    )
-    conn.commit()
-    conn.close()
+    with conn:
+        conn.execute(
+            SQL_UPDATE_APPT,
+            (status, title, clinician, notes, starts_at, ends_at, aid),
+        )
     return jsonify({"ok": True})
 
 
 @app.post("/api/appointments/<int:aid>/delete")
 def api_appointments_delete(aid: int) -> Response:
     conn = get_db()
-    conn.execute("DELETE FROM appointments WHERE id=?", (aid,))
-    conn.commit()
-    conn.close()
+    with conn:
+        conn.execute(SQL_DELETE_APPT, (aid,))
     return jsonify({"ok": True})
 
 
 # New: Labs basic APIs
 @app.get("/api/lab-tests")
 def api_lab_tests() -> Response:
-    conn = get_db()
-    rows = conn.execute("SELECT * FROM lab_tests WHERE is_active = 1 ORDER BY name").fetchall()
-    conn.close()
-    return jsonify([dict(r) for r in rows])
+    return cached_json(("lab_tests", ""), lambda: query_dicts(get_db(readonly=True), SQL_LIST_LAB_TESTS), None)
 
 
 @app.post("/api/lab-orders")
 def api_create_lab_order() -> Response:
     data = request.get_json(silent=True) or {}
     usn = (data.get("usn") or "").strip()
-    test_code = (data.get("test_code") or "").strip()
+    # test_codes orders several tests at once; test_code is kept for single-test callers
+    codes = data.get("test_codes") or [data.get("test_code")]
+    if not isinstance(codes, list):
+        return jsonify({"error": "test_codes must be a list"}), 400
+    codes = list(dict.fromkeys(str(c).strip() for c in codes if c and str(c).strip()))
     notes = (data.get("notes") or "").strip() or None
 
-    if not (usn and test_code):
+    if not (usn and codes):
         return jsonify({"error": "usn and test_code required"}), 400
 
     conn = get_db()
-    p = conn.execute("SELECT 1 FROM patients WHERE usn=?", (usn,)).fetchone()
-    if not p:
-        conn.close()
-        return jsonify({"error": "Patient not found"}), 404
-
-    test = conn.execute("SELECT id FROM lab_tests WHERE code=? AND is_active=1", (test_code,)).fetchone()
-    if not test:
-        conn.close()
-        return jsonify({"error": "Lab test not found"}), 404
+    with write_txn(conn):
+        tests = conn.execute(
+            f"SELECT id FROM lab_tests WHERE code IN ({','.join('?' * len(codes))}) AND is_active=1",
+            codes,
+        ).fetchall()
+        if len(tests) != len(codes):
+            return jsonify({"error": "Lab test not found"}), 404
 
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO lab_orders(usn, ordered_at, status, notes) VALUES(?,?,?,?)",
-        (usn, datetime.utcnow().isoformat(), "Ordered", notes),
-    )
-    order_id = cur.lastrowid
-    cur.execute(
-        "INSERT INTO lab_order_items(lab_order_id, lab_test_id) VALUES(?,?)",
-        (order_id, test["id"]),
-    )
-    conn.commit()
-    conn.close()
+        row = conn.execute(SQL_INSERT_LAB_ORDER, (usn, notes)).fetchone()
+        if row is None:
+            return jsonify({"error": "Patient not found"}), 404
+        order_id = row[0]
+        conn.executemany(SQL_INSERT_LAB_ITEM, [(order_id, t["id"]) for t in tests])
     return jsonify({"id": order_id}), 201
 
 
 @app.get("/api/lab-orders")
 def api_list_lab_orders() -> Response:
     usn = (request.args.get("usn") or "").strip()
-    conn = get_db()
-    if usn:
-        rows = conn.execute(
-            """
-            SELECT lo.*, loi.id AS item_id, lt.code, lt.name, loi.status, loi.result_value, loi.result_at
-            FROM lab_orders lo
-            JOIN lab_order_items loi ON loi.lab_order_id = lo.id
-            JOIN lab_tests lt ON lt.id = loi.lab_test_id
-            WHERE lo.usn = ?
-            ORDER BY lo.ordered_at DESC
-            """,
-            (usn,),
-        ).fetchall()
-    else:
-        rows = conn.execute(
-            """
-            SELECT lo.*, loi.id AS item_id, lt.code, lt.name, loi.status, loi.result_value, loi.result_at
-            FROM lab_orders lo
-            JOIN lab_order_items loi ON loi.lab_order_id = lo.id
-            JOIN lab_tests lt ON lt.id = loi.lab_test_id
-            ORDER BY lo.ordered_at DESC
-            LIMIT 200
-            """
-        ).fetchall()
-    conn.close()
-    return jsonify([dict(r) for r in rows])
+    try:
+        page = page_args()
+    except ValueError:
+        return jsonify({"error": "before_id and limit must be integers"}), 400
+    sql = SQL_LAB_ORDERS_PAGE_BY_USN if usn else SQL_LAB_ORDERS_PAGE
+    return cached_json(
+        ("lab_orders", repr((usn, *page.values()))),
+        lambda: query_dicts(get_db(readonly=True), sql, {**page, "usn": usn}),
+        None,
+    )
 
 
 @app.post("/api/lab-results/<int:item_id>")
@@ -1009,28 +1490,12 @@ def api_set_lab_result(item_id: int) -> Response:
     notes = (data.get("result_notes") or "").strip() or None
 
     conn = get_db()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        UPDATE lab_order_items
-        SET result_value = ?, result_notes = ?, result_at = ?, status = 'Completed'
-        WHERE id = ?
-        """,
-        (value, notes, datetime.utcnow().isoformat(), item_id),
-    )
-    # If all items completed, mark order completed
-    cur.execute(
-        """
-        UPDATE lab_orders
-           SET status = CASE WHEN NOT EXISTS (
-                SELECT 1 FROM lab_order_items WHERE lab_order_id = lab_orders.id AND status <> 'Completed'
-           ) THEN 'Completed' ELSE status END
-        WHERE id = (SELECT lab_order_id FROM lab_order_items WHERE id = ?)
-        """,
-        (item_id,),
-    )
-    conn.commit()
-    conn.close()
+    with write_txn(conn):
+        row = conn.execute(SQL_SET_LAB_RESULT, (value, notes, item_id)).fetchone()
+        if row is None:
+            return jsonify({"error": "Lab order item not found"}), 404
+        # If all items completed, mark order completed
+        conn.execute(SQL_COMPLETE_LAB_ORDER, (row[0],))
     return jsonify({"ok": True})
 
 
@@ -1038,88 +1503,37 @@ def api_set_lab_result(item_id: int) -> Response:
 @app.get("/api/metrics")
 def api_metrics() -> Response:
     today = date.today().isoformat()
-    conn = get_db()
-    patients_count = conn.execute("SELECT COUNT(1) FROM patients").fetchone()[0]
-    appts_today = conn.execute(
-        "SELECT COUNT(1) FROM appointments WHERE substr(starts_at,1,10) = ?",
-        (today,),
-    ).fetchone()[0]
-    labs_pending = conn.execute(
-        "SELECT COUNT(1) FROM lab_order_items WHERE status <> 'Completed'"
-    ).fetchone()[0]
-    vitals_today = conn.execute(
-        "SELECT COUNT(1) FROM vitals WHERE substr(recorded_at,1,10) = ?",
-        (today,),
-    ).fetchone()[0]
-    conn.close()
-    return jsonify({
-        "patients": patients_count,
-        "appointments_today": appts_today,
-        "labs_pending": labs_pending,
-        "vitals_today": vitals_today,
-    })
+    tomorrow = (date.today() + timedelta(days=1)).isoformat()
 
+    def build() -> Any:
+        conn = get_db(readonly=True)
+        counts = conn.execute(SQL_METRICS, (today, tomorrow)).fetchone()
+        patients_count, appts_today, labs_pending, vitals_today = counts
+        return {
+            "patients": patients_count,
+            "appointments_today": appts_today,
+            "labs_pending": labs_pending,
+            "vitals_today": vitals_today,
+        }
 
-# Export CSV (fix latest vitals selection)
+    # Keyed by day so the counts roll over at midnight; writes expire it early
+    return cached_json(("metrics", today), build, METRICS_CACHE_TTL)
+
+
+# Export CSV: one row per patient x prescription, with the latest vitals
 @app.get("/export.csv")
 def export_csv() -> Response:
-    conn = get_db()
-    patients = conn.execute("SELECT * FROM patients").fetchall()
-    vitals_map: Dict[str, sqlite3.Row] = {}
-    for v in conn.execute(
-        """
-        SELECT v.* FROM vitals v
-        JOIN (
-            SELECT usn, MAX(recorded_at) AS latest
-            FROM vitals
-            GROUP BY usn
-        ) m ON m.usn = v.usn AND m.latest = v.recorded_at
-        """
-    ).fetchall():
-        vitals_map[v["usn"]] = v
-
-    rx = conn.execute("SELECT * FROM prescriptions").fetchall()
-    conn.close()
+    conn = get_db(readonly=True)
+    # Plain tuples in SELECT order go straight to the CSV writer
+    cur = execute_raw(conn, SQL_EXPORT_ALL)
 
     header = [
         "USN","Full Name","Age","Gender","Contact","Address",
         "BP","Pulse","Temp","Weight","Height","Vitals Time",
         "Prescription","Prescribed At"
     ]
-    rows: List[List[str]] = []
-
-    for p in patients:
-        p_usn = p["usn"]
-        v = vitals_map.get(p_usn)
-        related = [r for r in rx if r["usn"] == p_usn]
-        if not related:
-            rows.append([
-                p_usn, p["full_name"], str(p["age"]), p["gender"], p["contact"], p["address"],
-                v["blood_pressure"] if v else "", str(v["pulse"]) if v else "", str(v["temperature"]) if v else "",
-                str(v["weight"]) if v else "", str(v["height"]) if v else "", v["recorded_at"] if v else "",
-                "", ""
-            ])
-        else:
-            for r in related:
-                rows.append([
-                    p_usn, p["full_name"], str(p["age"]), p["gender"], p["contact"], p["address"],
-                    v["blood_pressure"] if v else "", str(v["pulse"]) if v else "", str(v["temperature"]) if v else "",
-                    str(v["weight"]) if v else "", str(v["height"]) if v else "", v["recorded_at"] if v else "",
-                    r["notes"].replace("\n", " "), r["prescribed_at"]
-                ])
-
-    buf = io.StringIO()
-    cw = csv.writer(buf)
-    cw.writerow(header)
-    cw.writerows(rows)
-    data = buf.getvalue()
-    return Response(
-        data,
-        mimetype="text/csv",
-        headers={"Content-Disposition": f"attachment; filename=hmis-export.csv"},
-    )
+    return stream_csv(header, cur, "hmis-export.csv")
 
 
 if __name__ == "__main__":
-    init_db()
     app.run(debug=True)
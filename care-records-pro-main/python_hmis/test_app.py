@@ -0,0 +1,191 @@
+import io
+import os
+import tempfile
+
+# Must be set before app is imported: ensure_db() runs at import time
+os.environ.setdefault("HMIS_DB_PATH", os.path.join(tempfile.mkdtemp(), "hmis.db"))
+
+import pytest
+
+import app as hmis
+
+
+def _drain_pools() -> None:
+    for pool in (hmis._RW_POOL, hmis._RO_POOL):
+        while not pool.empty():
+            pool.get_nowait().close()
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    """A test client on a fresh database with two patients, U1 and U2."""
+    _drain_pools()
+    monkeypatch.setattr(hmis, "DB_PATH", str(tmp_path / "hmis.db"))
+    hmis._API_CACHE.clear()
+    hmis.ensure_db()
+    hmis.fill_pools()
+    c = hmis.app.test_client()
+    for usn in ("U1", "U2"):
+        patient = {"usn": usn, "fullName": f"Patient {usn}", "age": 30, "gender": "F", "phone": "1", "address": "a"}
+        assert c.post("/api/patients", json=patient).status_code == 201
+    yield c
+    _drain_pools()
+
+
+def _vitals(usn: str = "U1", **overrides):
+    row = {
+        "usn": usn, "weight": 60, "height": 170, "bloodPressureSystolic": 120,
+        "bloodPressureDiastolic": 80, "heartRate": 70, "temperature": 37,
+    }
+    row.update(overrides)
+    return row
+
+
+def _patient_count(c) -> int:
+    return len(c.get("/api/patients").get_json())
+
+
+# --- CSV import ---
+
+def test_import_patients_upload_with_header(client):
+    data = "USN,Full Name,Age,Gender,Contact,Address\nI1,Ann,40,F,555,Street\nI2,Bob,41,M,556,Road\n"
+    r = client.post(
+        "/api/import/patients",
+        data={"file": (io.BytesIO(data.encode("utf-8-sig")), "patients.csv")},
+        content_type="multipart/form-data",
+    )
+    assert r.status_code == 201
+    assert r.get_json() == {"inserted": 2}
+    assert _patient_count(client) == 4
+
+
+def test_import_patients_duplicate_usn(client):
+    r = client.post("/api/import/patients", data="I1,Ann,40,F,555,x\nU1,Dup,3,F,1,a\n", content_type="text/csv")
+    assert r.status_code == 409
+    assert _patient_count(client) == 2
+
+
+@pytest.mark.parametrize("body", ["I1,Ann,forty,F,555,x\n", "I1,Ann\n", "", b"\xff\xfeI1,Ann\n"])
+def test_import_patients_rejects_bad_input(client, body):
+    r = client.post("/api/import/patients", data=body, content_type="text/csv")
+    assert r.status_code == 400
+    assert _patient_count(client) == 2
+
+
+# --- Bulk JSON ingest ---
+
+def test_patients_bulk_rolls_back_on_duplicate(client):
+    rows = [
+        {"usn": "B1", "fullName": "Ann", "age": 40, "gender": "F"},
+        {"usn": "U1", "fullName": "Dup", "age": 41, "gender": "M"},
+    ]
+    assert client.post("/api/patients/bulk", json=rows).status_code == 409
+    assert _patient_count(client) == 2
+
+
+def test_vitals_bulk_rolls_back_on_unknown_patient(client):
+    r = client.post("/api/vitals/bulk", json=[_vitals("U1"), _vitals("NOPE")])
+    assert r.status_code == 404
+    assert client.get("/api/vitals?usn=U1").get_json() == []
+
+    r = client.post("/api/vitals/bulk", json=[_vitals("U1"), _vitals("U2", heartRate="fast")])
+    assert r.status_code == 400
+    assert client.get("/api/vitals?usn=U1").get_json() == []
+
+
+def test_vitals_stats(client):
+    r = client.post("/api/vitals/bulk", json=[_vitals("U1", heartRate=60), _vitals("U1", heartRate=80), _vitals("U2")])
+    assert r.get_json() == {"inserted": 3}
+    stats = client.get("/api/vitals/stats?usn=U1").get_json()
+    assert stats["count"] == 2
+    assert stats["heart_rate"] == {"avg": 70.0, "min": 60, "max": 80}
+    assert client.get("/api/vitals/stats").get_json()["count"] == 3
+
+
+# --- Lab orders ---
+
+def _lab_order_codes(c, usn: str):
+    # The listing returns one row per order item
+    codes = {}
+    for row in c.get(f"/api/lab-orders?usn={usn}").get_json():
+        codes.setdefault(row["id"], []).append(row["code"])
+    return [sorted(v) for v in codes.values()]
+
+
+def test_lab_order_with_test_codes_list(client):
+    r = client.post("/api/lab-orders", json={"usn": "U1", "test_codes": ["GLU", "CBC", "GLU"]})
+    assert r.status_code == 201
+    assert _lab_order_codes(client, "U1") == [["CBC", "GLU"]]
+
+
+def test_lab_order_with_legacy_test_code(client):
+    assert client.post("/api/lab-orders", json={"usn": "U1", "test_code": "LFT"}).status_code == 201
+    assert _lab_order_codes(client, "U1") == [["LFT"]]
+
+
+@pytest.mark.parametrize("body, status", [
+    ({"usn": "U1", "test_codes": ["GLU", "NOPE"]}, 404),
+    ({"usn": "U1", "test_code": "NOPE"}, 404),
+    ({"usn": "NOPE", "test_codes": ["GLU"]}, 404),
+    ({"usn": "U1", "test_codes": "GLU"}, 400),
+    ({"usn": "U1"}, 400),
+])
+def test_lab_order_rejected(client, body, status):
+    assert client.post("/api/lab-orders", json=body).status_code == status
+    assert client.get("/api/lab-orders").get_json() == []
+
+
+# --- Keyset paging ---
+
+def test_appointments_keyset_paging(client):
+    ids = []
+    for starts in ("2030-01-01T09:00", "2030-01-02T09:00", "2030-01-02T09:00", "2030-01-03T09:00"):
+        r = client.post("/api/appointments", json={"usn": "U1", "starts_at": starts, "ends_at": starts})
+        ids.append(r.get_json()["id"])
+    newest_first = [ids[3], ids[2], ids[1], ids[0]]
+
+    page1 = client.get("/api/appointments?usn=U1&limit=2").get_json()
+    assert [a["id"] for a in page1] == newest_first[:2]
+    # The cursor row shares its starts_at with the next one; before_id splits the tie
+    last = page1[-1]
+    page2 = client.get(f"/api/appointments?usn=U1&limit=2&before={last['starts_at']}&before_id={last['id']}").get_json()
+    assert [a["id"] for a in page2] == newest_first[2:]
+    # Without before_id every row at that timestamp is skipped
+    page = client.get(f"/api/appointments?usn=U1&before={last['starts_at']}").get_json()
+    assert [a["id"] for a in page] == [ids[0]]
+    assert client.get("/api/appointments?usn=U2").get_json() == []
+    assert client.get("/api/appointments?before_id=x").status_code == 400
+
+
+def test_lab_orders_keyset_paging(client):
+    for usn in ("U1", "U1", "U1", "U2"):
+        assert client.post("/api/lab-orders", json={"usn": usn, "test_code": "CBC"}).status_code == 201
+
+    page1 = client.get("/api/lab-orders?usn=U1&limit=2").get_json()
+    assert len(page1) == 2
+    last = page1[-1]
+    page2 = client.get(f"/api/lab-orders?usn=U1&limit=2&before={last['ordered_at']}&before_id={last['id']}").get_json()
+    ids = [o["id"] for o in page1 + page2]
+    assert len(ids) == 3 and ids == sorted(ids, reverse=True)
+    assert len(client.get("/api/lab-orders").get_json()) == 4
+
+
+# --- Conditional GETs ---
+
+@pytest.mark.parametrize("url", ["/api/appointments", "/api/lab-orders", "/api/vitals?usn=U1"])
+def test_if_none_match_revalidates_until_a_write(client, url):
+    etag = client.get(url).headers["ETag"]
+    r = client.get(url, headers={"If-None-Match": etag})
+    assert r.status_code == 304
+    assert r.get_data() == b""
+
+    # A rejected write changes nothing, so the ETag still matches
+    assert client.post("/api/vitals", json={"usn": "U1"}).status_code == 400
+    assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
+
+    assert client.post("/api/vitals", json=_vitals("U1")).status_code == 201
+    assert client.post("/api/appointments", json={"usn": "U1", "starts_at": "2030-01-01", "ends_at": "2030-01-01"}).status_code == 201
+    assert client.post("/api/lab-orders", json={"usn": "U1", "test_code": "CBC"}).status_code == 201
+    r = client.get(url, headers={"If-None-Match": etag})
+    assert r.status_code == 200
+    assert len(r.get_json()) == 1
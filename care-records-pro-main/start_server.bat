@@ -7,6 +7,7 @@ echo.
 echo Starting HMIS Backend Server...
 echo Server will be available at: http://localhost:5000
 echo Open hmis-standalone.html in your browser for the frontend
+echo Set HMIS_DEBUG=1 for the Flask debug server
 echo Press Ctrl+C to stop the server
 echo.
 
@@ -19,11 +20,16 @@ if not exist "app.py" (
     exit /b 1
 )
 
-set FLASK_APP=app.py
-set FLASK_ENV=development
-set FLASK_DEBUG=1
+if not defined HMIS_THREADS set HMIS_THREADS=8
 
-python -m flask run --host=0.0.0.0 --port=5000
+if "%HMIS_DEBUG%"=="1" (
+    set FLASK_APP=app.py
+    set FLASK_ENV=development
+    set FLASK_DEBUG=1
+    python -m flask run --host=0.0.0.0 --port=5000
+) else (
+    python -m waitress --host=0.0.0.0 --port=5000 --threads=%HMIS_THREADS% app:app
+)
 
 echo.
 echo Server stopped.
@@ -29,24 +29,32 @@ def main():
     print(f"📁 Working directory: {app_dir}")
     print("🌐 Server will be available at: http://localhost:5000")
     print("📊 HMIS Frontend: Open hmis-standalone.html in your browser")
+    print("🐞 Set HMIS_DEBUG=1 for the Flask debug server")
     print("⏹️  Press Ctrl+C to stop the server")
     print("-" * 60)
     
     try:
-        # Change to the app directory and run Flask
+        # Change to the app directory and run the server
         os.chdir(app_dir)
         
-        # Set Flask environment variables
         env = os.environ.copy()
-        env['FLASK_APP'] = 'app.py'
-        env['FLASK_ENV'] = 'development'
-        env['FLASK_DEBUG'] = '1'
-        
-        # Run Flask
-        subprocess.run([
-            sys.executable, '-m', 'flask', 'run', 
-            '--host=0.0.0.0', '--port=5000'
-        ], env=env)
+        if env.get('HMIS_DEBUG') == '1':
+            # Opt-in: Flask's reloading debug server
+            env['FLASK_APP'] = 'app.py'
+            env['FLASK_ENV'] = 'development'
+            env['FLASK_DEBUG'] = '1'
+            subprocess.run([
+                sys.executable, '-m', 'flask', 'run', 
+                '--host=0.0.0.0', '--port=5000'
+            ], env=env)
+        else:
+            # Production WSGI server; threads share the app's SQLite connection pool
+            subprocess.run([
+                sys.executable, '-m', 'waitress',
+                '--host=0.0.0.0', '--port=5000',
+                f"--threads={env.get('HMIS_THREADS', '8')}",
+                'app:app'
+            ], env=env)
         
     except KeyboardInterrupt:
         print("\n🛑 Server stopped by user")